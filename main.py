@@ -1,32 +1,75 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+try:
+    import orjson  # much faster decode for the big paged market responses
+except ImportError:
+    orjson = None
 import os
+import random
 import time
 from datetime import datetime
 
 # --- CONFIGURATION ---
 BASE_URL = "https://api.elections.kalshi.com/trade-api/v2"
 DATA_FOLDER = "market_data"
+CACHE_FILE = "markets_cache.parquet"
+CACHE_TTL_SECONDS = 300  # reruns within 5 min reuse the last fetched list
+
+# One shared session so every call reuses the same keep-alive connection
+# instead of paying a fresh TCP+TLS handshake per request
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1, pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+))
+SESSION.headers.update({"User-Agent": "GitHubActionBot/1.0"})
 
 def polite_request(url, params=None):
-    try:
-        r = requests.get(url, params=params, headers={"User-Agent": "GitHubActionBot/1.0"}, timeout=10)
-        if r.status_code == 200: 
-            return r.json()
-        elif r.status_code == 429:
-            print("  [!] Rate limit. Sleeping 1s...")
-            time.sleep(1)
-            return polite_request(url, params)
-    except Exception as e:
-        print(f"Connection Error: {e}")
+    # Iterative retry loop (the old version recursed on every 429)
+    for attempt in range(6):
+        try:
+            r = SESSION.get(url, params=params, timeout=10)
+            if r.status_code == 200:
+                return orjson.loads(r.content) if orjson else r.json()
+            elif r.status_code == 429:
+                # Exponential backoff with jitter; honor Retry-After as a floor
+                delay = min(60, 0.5 * 2 ** attempt) + random.random() * 0.2
+                retry_after = r.headers.get('Retry-After')
+                if retry_after:
+                    try:
+                        delay = max(delay, float(retry_after))
+                    except ValueError:
+                        pass
+                print(f"  [!] Rate limit. Sleeping {delay:.1f}s...")
+                time.sleep(delay)
+                continue
+            return None
+        except Exception as e:
+            print(f"Connection Error: {e}")
+            return None
     return None
 
 def fetch_all_active_markets():
+    # Replayed Action runs / quick debugging reruns skip the ~50 round trips
+    # and reuse the last snapshot if it is fresh enough (FORCE_REFRESH bypasses)
+    if not os.getenv("FORCE_REFRESH") and os.path.exists(CACHE_FILE):
+        age = time.time() - os.path.getmtime(CACHE_FILE)
+        if age < CACHE_TTL_SECONDS:
+            cached = pd.read_parquet(CACHE_FILE).to_dict('records')
+            print(f"  -> Using cached market list ({len(cached)} markets, {age:.0f}s old)")
+            return cached
+
     all_markets = []
     cursor = None
     page_count = 0
     retry_count = 0
-    
+    log_lines = []
+
     print("  -> Fetching market pages...")
     while True:
         params = {"limit": 100, "status": "open"}
@@ -48,13 +91,19 @@ def fetch_all_active_markets():
         
         all_markets.extend(markets)
         page_count += 1
-        print(f"     Page {page_count}: Found {len(markets)} markets...")
-        
+        log_lines.append(f"     Page {page_count}: Found {len(markets)} markets...")
+
         cursor = data.get('cursor')
         if not cursor: break
-        time.sleep(0.2) 
-        
+        time.sleep(0.2)
+
+    # One write to stdout for the whole scan instead of a print per page
+    if log_lines:
+        print("\n".join(log_lines))
     print(f"  -> Scanned {page_count} pages. Total candidates: {len(all_markets)}")
+
+    if all_markets:
+        pd.DataFrame(all_markets).to_parquet(CACHE_FILE, index=False)
     return all_markets
 
 def run_binary_hoarder():
@@ -65,69 +114,85 @@ def run_binary_hoarder():
         os.makedirs(DATA_FOLDER)
         
     markets = fetch_all_active_markets()
-    snapshot_rows = []
-    
-    for m in markets:
-        # 1. BINARY FILTER: Must have valid Yes/No prices
-        if 'yes_bid' not in m or 'yes_ask' not in m: continue
-            
-        yes_bid = m.get('yes_bid', 0)
-        yes_ask = m.get('yes_ask', 0)
-        
-        # Skip "Dead" markets (Price 0 or 100) - No signal there for ML
-        if yes_bid == 0 and yes_ask == 0: continue
 
-        # 2. FEATURE ENGINEERING
-        spread = yes_ask - yes_bid
-        midpoint = (yes_ask + yes_bid) / 2
-        
-        # Calculate Time to Close (Critical for ML)
-        close_str = m.get('close_time')
-        hours_left = 0
-        if close_str:
-            try:
-                close_dt = datetime.strptime(close_str, "%Y-%m-%dT%H:%M:%SZ")
-                delta = close_dt - now
-                hours_left = delta.total_seconds() / 3600
-            except:
-                hours_left = -1
-
-        # Extract Category & Class
-        category = m.get('category', 'Uncategorized')
-        ticker_parts = m['ticker'].split('-')
-        ticker_class = ticker_parts[0] if ticker_parts else 'UNKNOWN'
-
-        snapshot_rows.append({
-            'timestamp': now,
-            'ticker': m['ticker'],
-            'category': category,          # Feature: Market Type (Crypto, Politics)
-            'class': ticker_class,         # Feature: Sub-Type (BTC, FED)
-            'hours_to_close': round(hours_left, 2), # Feature: Time Decay
-            'yes_bid': yes_bid,
-            'yes_ask': yes_ask,
-            'spread': spread,              # Feature: Liquidity Cost
-            'midpoint': midpoint,          # Feature: "True" Price
-            'volume': m.get('volume', 0),  # Feature: Activity
-            'open_interest': m.get('open_interest', 0), # Feature: Depth
-            'close_date': close_str
-        })
-        
-    if not snapshot_rows:
+    # Only pull the fields we actually use; the API returns ~30 per market
+    df = pd.DataFrame(markets, columns=[
+        'ticker', 'yes_bid', 'yes_ask', 'close_time',
+        'category', 'volume', 'open_interest'
+    ])
+
+    # 1. BINARY FILTER: Must have valid Yes/No prices
+    valid = df['yes_bid'].notna() & df['yes_ask'].notna()
+    # Skip "Dead" markets (Price 0 or 100) - No signal there for ML
+    valid &= ~((df['yes_bid'] == 0) & (df['yes_ask'] == 0))
+    df = df[valid]
+
+    if df.empty:
         print("No valid binary markets found.")
         return
 
-    # 3. SAVE TO DAILY FILE
+    # 2. FEATURE ENGINEERING (vectorized over the whole market list)
+    yes_bid = df['yes_bid']
+    yes_ask = df['yes_ask']
+    spread = yes_ask - yes_bid
+    midpoint = (yes_ask + yes_bid) / 2
+
+    # Calculate Time to Close (Critical for ML)
+    close_str = df['close_time']
+    # Fixed format skips pandas' per-value format inference (API always sends this shape)
+    close_dt = pd.to_datetime(close_str, format="%Y-%m-%dT%H:%M:%SZ", errors='coerce')
+    hours_left = ((close_dt - now).dt.total_seconds() / 3600).round(2)
+    # Missing close_time -> 0, unparseable -> -1 (same as the old per-row logic)
+    hours_left = hours_left.fillna(-1).where(close_str.notna(), 0)
+
+    # Extract Category & Class
+    category = df['category'].fillna('Uncategorized')
+    # Only the prefix matters, so stop splitting at the first '-'
+    ticker_class = df['ticker'].str.split('-', n=1).str[0]
+
+    df_new = pd.DataFrame({
+        'timestamp': now,
+        'ticker': df['ticker'],
+        'category': category,          # Feature: Market Type (Crypto, Politics)
+        'class': ticker_class,         # Feature: Sub-Type (BTC, FED)
+        'hours_to_close': hours_left,  # Feature: Time Decay
+        'yes_bid': yes_bid,
+        'yes_ask': yes_ask,
+        'spread': spread,              # Feature: Liquidity Cost
+        'midpoint': midpoint,          # Feature: "True" Price
+        'volume': df['volume'].fillna(0),  # Feature: Activity
+        'open_interest': df['open_interest'].fillna(0), # Feature: Depth
+        'close_date': close_str
+    })
+
+    # Compact, explicit dtypes instead of the float64/object defaults
+    df_new = df_new.astype({
+        'hours_to_close': 'float32',
+        'yes_bid': 'int16',   # prices live in [0, 100] cents
+        'yes_ask': 'int16',
+        'spread': 'int16',
+        'midpoint': 'float32',
+        'volume': 'int64',
+        'open_interest': 'int64',
+    })
+
+    # 3. SAVE SNAPSHOT TO DATE/CATEGORY-PARTITIONED PARQUET DATASET
+    # Each run writes its own small zstd file under market_data/date=.../category=...,
+    # so readers can predicate-push on date or category instead of scanning a giant CSV
     date_str = now.strftime('%Y-%m-%d')
-    filename = f"{DATA_FOLDER}/{date_str}.csv"
-    
-    df_new = pd.DataFrame(snapshot_rows)
-    
-    if os.path.exists(filename):
-        df_new.to_csv(filename, mode='a', header=False, index=False)
-        print(f"  -> Appended {len(df_new)} rows to {filename}")
-    else:
-        df_new.to_csv(filename, index=False)
-        print(f"  -> Created new daily file: {filename}")
+    df_new['date'] = date_str
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df_new, preserve_index=False),
+        DATA_FOLDER,
+        format='parquet',
+        partitioning=['date', 'category'],
+        partitioning_flavor='hive',
+        existing_data_behavior='overwrite_or_ignore',
+        basename_template=f"part-{now.strftime('%H%M%S')}-{{i}}.zstd.parquet",
+        file_options=ds.ParquetFileFormat().make_write_options(compression='zstd'),
+    )
+    print(f"  -> Wrote {len(df_new)} rows to {DATA_FOLDER}/date={date_str}/")
 
 if __name__ == "__main__":
     run_binary_hoarder()